@@ -0,0 +1,87 @@
+import os
+import csv
+
+# Columns of the boundaries sidecar and the type of each one
+BOUNDARY_FIELDS = {"file": str,
+                   "start_sample": int,
+                   "n_samples": int,
+                   "sampling_rate": float,
+                   }
+
+
+def get_boundaries(dat_files, recordings):
+    """
+    Get the subsession boundaries of a concatenated recording.
+
+    Parameters
+    ----------
+    dat_files : list of str
+        Paths of the .dat files, in the order they were concatenated.
+    recordings : list
+        SpikeInterface recordings matching dat_files.
+
+    Returns
+    -------
+    list of dict
+        One entry per subsession with the keys of BOUNDARY_FIELDS.
+    """
+    boundaries = []
+    start_sample = 0
+    for f, rec in zip(dat_files, recordings):
+        n_samples = int(rec.get_num_samples())
+        boundaries.append({
+            "file": f,
+            "start_sample": start_sample,
+            "n_samples": n_samples,
+            "sampling_rate": float(rec.get_sampling_frequency())
+        })
+        start_sample += n_samples
+    return boundaries
+
+
+def write_boundaries(file_path, boundaries):
+    """
+    Write the subsession boundaries of a concatenated recording to a .csv sidecar file.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the .csv file to write.
+    boundaries : list of dict
+        Subsession boundaries, as returned by get_boundaries.
+    """
+    with open(file_path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(BOUNDARY_FIELDS))
+        writer.writeheader()
+        writer.writerows(boundaries)
+
+    print(f"Subsession boundaries saved to: {file_path}")
+
+
+def load_boundaries(file_path):
+    """
+    Load the subsession boundaries written during concatenation.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the 'concatenated_recording_boundaries.csv' file.
+
+    Returns
+    -------
+    list of dict
+        One entry per subsession with the keys of BOUNDARY_FIELDS.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the boundaries file does not exist.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Boundaries file not found: {file_path}")
+
+    boundaries = []
+    with open(file_path, newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            boundaries.append({field: cast(row[field]) for field, cast in BOUNDARY_FIELDS.items()})
+    return boundaries
@@ -0,0 +1,401 @@
+import os
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from scipy.ndimage import gaussian_filter1d
+
+
+def _amplitude_cutoff(amplitudes, spike_clusters, starts, n_clusters, n_bins, smoothing):
+    """
+    Estimate the fraction of missing spikes of every cluster from its amplitude distribution.
+
+    Parameters
+    ----------
+    amplitudes : numpy.ndarray
+        Spike amplitudes, sorted by cluster.
+    spike_clusters : numpy.ndarray
+        Cluster label (0 to n_clusters - 1) of each spike, sorted.
+    starts : numpy.ndarray
+        Index of the first spike of each cluster.
+    n_clusters : int
+        Number of clusters.
+    n_bins : int
+        Number of histogram bins per cluster.
+    smoothing : float
+        Standard deviation, in bins, of the Gaussian used to smooth the histograms.
+
+    Returns
+    -------
+    numpy.ndarray
+        Amplitude cutoff of each cluster, capped at 0.5.
+    """
+    # Histograms of all clusters at once, each one spanning the amplitude range of its cluster
+    amp_min = np.minimum.reduceat(amplitudes, starts)
+    amp_range = np.maximum.reduceat(amplitudes, starts) - amp_min
+    amp_range[amp_range == 0] = 1
+    bins = ((amplitudes - amp_min[spike_clusters]) / amp_range[spike_clusters] * n_bins).astype(np.int64)
+    bins = np.minimum(bins, n_bins - 1)
+    hist = np.bincount(spike_clusters * n_bins + bins, minlength=n_clusters * n_bins).reshape(n_clusters, n_bins)
+
+    pdf = gaussian_filter1d(hist.astype(float), smoothing, axis=1)
+    pdf /= pdf.sum(axis=1, keepdims=True)
+
+    # Find, above the peak, the bin whose density matches the lowest amplitude bin
+    columns = np.arange(n_bins)
+    peak = np.argmax(pdf, axis=1)
+    distance = np.abs(pdf - pdf[:, :1])
+    distance[columns[None, :] < peak[:, None]] = np.inf
+    cutoff_bin = np.argmin(distance, axis=1)
+    fraction_missing = np.where(columns[None, :] >= cutoff_bin[:, None], pdf, 0).sum(axis=1)
+    return np.minimum(fraction_missing, 0.5)
+
+
+def _neighbour_ccgs(spike_times, starts, ends, positions, radius, window, bin_size):
+    """
+    Compute cross-correlograms for every pair of clusters closer than radius.
+
+    Parameters
+    ----------
+    spike_times : numpy.ndarray
+        Spike times in samples, sorted by cluster and then by time.
+    starts : numpy.ndarray
+        Index of the first spike of each cluster.
+    ends : numpy.ndarray
+        Index after the last spike of each cluster.
+    positions : numpy.ndarray
+        (n_clusters, 2) array with the position of each cluster in microns.
+    radius : float
+        Maximum distance in microns between two clusters for their CCG to be computed.
+    window : int
+        Half width of the CCG in samples, a multiple of bin_size.
+    bin_size : int
+        Width of each CCG bin in samples.
+
+    Returns
+    -------
+    numpy.ndarray
+        (n_pairs, 2) array with the cluster labels of each pair.
+    numpy.ndarray
+        (n_pairs, n_bins) array with the spike counts of each CCG.
+    """
+    n_bins = 2 * window // bin_size
+    distance = np.sqrt(((positions[:, None, :] - positions[None, :, :]) ** 2).sum(axis=-1))
+
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    ccgs = [np.zeros((0, n_bins), dtype=np.int64)]
+    for a in range(len(positions)):
+        neighbours = np.flatnonzero(distance[a, a + 1:] <= radius) + a + 1
+        if neighbours.size == 0:
+            continue
+
+        # Merge the spikes of all neighbours of a into one sorted train, keeping track of their origin
+        times_a = spike_times[starts[a]:ends[a]]
+        times_b = np.concatenate([spike_times[starts[b]:ends[b]] for b in neighbours])
+        labels_b = np.repeat(np.arange(neighbours.size), ends[neighbours] - starts[neighbours])
+        order = np.argsort(times_b, kind='stable')
+        times_b = times_b[order]
+        labels_b = labels_b[order]
+
+        # Every spike of a is paired with the spikes of b that fall in [t - window, t + window)
+        lo = np.searchsorted(times_b, times_a - window, side='left')
+        hi = np.searchsorted(times_b, times_a + window, side='left')
+        counts = hi - lo
+        total = counts.sum()
+        hist = np.zeros((neighbours.size, n_bins), dtype=np.int64)
+        if total > 0:
+            idx = np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(total)
+            lags = times_b[idx] - np.repeat(times_a, counts)
+            bins = (lags + window) // bin_size
+            hist = np.bincount(labels_b[idx] * n_bins + bins,
+                               minlength=neighbours.size * n_bins).reshape(neighbours.size, n_bins)
+
+        pairs.append(np.column_stack([np.full(neighbours.size, a), neighbours]))
+        ccgs.append(hist)
+
+    return np.concatenate(pairs), np.concatenate(ccgs)
+
+
+def _shank_metrics(spike_times, spike_clusters, amplitudes, positions, fs, duration, options):
+    """
+    Compute the metrics of the clusters of a single shank.
+
+    Parameters
+    ----------
+    spike_times : numpy.ndarray
+        Spike times in samples.
+    spike_clusters : numpy.ndarray
+        Cluster label (0 to n_clusters - 1) of each spike.
+    amplitudes : numpy.ndarray
+        Amplitude of each spike.
+    positions : numpy.ndarray
+        (n_clusters, 2) array with the position of each cluster in microns.
+    fs : float
+        Sampling frequency in Hz.
+    duration : float
+        Duration of the recording in seconds.
+    options : dict
+        Metric parameters, see cluster_metrics.
+
+    Returns
+    -------
+    dict
+        Per-cluster metrics, plus the pairs and counts of the neighbour CCGs.
+    """
+    n_clusters = len(positions)
+    order = np.lexsort((spike_times, spike_clusters))
+    spike_times = spike_times[order]
+    spike_clusters = spike_clusters[order]
+    amplitudes = amplitudes[order]
+
+    labels = np.arange(n_clusters)
+    starts = np.searchsorted(spike_clusters, labels, side='left')
+    ends = np.searchsorted(spike_clusters, labels, side='right')
+    n_spikes = ends - starts
+
+    # ISI violations, consecutive spikes of the same cluster closer than the refractory period
+    refractory = options["refractory_ms"] / 1000
+    violations = (spike_clusters[1:] == spike_clusters[:-1]) & (np.diff(spike_times) < refractory * fs)
+    isi_viol_count = np.bincount(spike_clusters[1:][violations], minlength=n_clusters)
+    # Contamination rate from Hill et al. (2011)
+    isi_viol_rate = isi_viol_count * duration / (2 * n_spikes.astype(float) ** 2 * refractory)
+
+    amplitude_cutoff = _amplitude_cutoff(amplitudes, spike_clusters, starts, n_clusters,
+                                         options["amplitude_bins"], options["amplitude_smoothing"])
+
+    bin_size = max(int(round(options["ccg_bin_ms"] * fs / 1000)), 1)
+    window = int(round(options["ccg_window_ms"] / options["ccg_bin_ms"])) * bin_size
+    pairs, ccgs = _neighbour_ccgs(spike_times, starts, ends, positions,
+                                  options["neighbour_radius"], window, bin_size)
+
+    return {"n_spikes": n_spikes,
+            "firing_rate": n_spikes / duration,
+            "isi_viol_count": isi_viol_count,
+            "isi_viol_rate": isi_viol_rate,
+            "amplitude_cutoff": amplitude_cutoff,
+            "pairs": pairs,
+            "ccgs": ccgs,
+            }
+
+
+def cluster_metrics(spike_times, spike_clusters, amplitudes, spike_positions, probe, fs, n_samples=None,
+                    refractory_ms=1.5, ccg_window_ms=50.0, ccg_bin_ms=1.0, neighbour_radius=100.0,
+                    amplitude_bins=100, amplitude_smoothing=3, n_jobs=None):
+    """
+    Compute quality metrics and neighbour cross-correlograms for every cluster.
+
+    Parameters
+    ----------
+    spike_times : numpy.ndarray
+        Spike times in samples. If 2D (as Kilosort's st), the first column is used.
+    spike_clusters : numpy.ndarray
+        Cluster label of each spike.
+    amplitudes : numpy.ndarray
+        Amplitude of each spike.
+    spike_positions : numpy.ndarray
+        (n_spikes, 2) array with the x and y position of each spike in microns.
+    probe : dict
+        Probe dictionary with 'xc', 'yc' and 'kcoords', as returned by kilosort.io.load_probe.
+    fs : float
+        Sampling frequency in Hz.
+    n_samples : int, optional
+        Number of samples in the recording. If None, the last spike time is used,
+        which underestimates the duration and overestimates firing and violation rates.
+    refractory_ms : float, optional
+        Refractory period in ms for ISI violations. Default 1.5.
+    ccg_window_ms : float, optional
+        Half width of the cross-correlograms in ms. Default 50.
+    ccg_bin_ms : float, optional
+        Bin width of the cross-correlograms in ms. Default 1.
+    neighbour_radius : float, optional
+        Maximum distance in microns between two clusters for their CCG to be computed. Default 100.
+    amplitude_bins : int, optional
+        Number of histogram bins used for the amplitude cutoff. Default 100.
+    amplitude_smoothing : float, optional
+        Standard deviation, in bins, of the Gaussian used to smooth the amplitude histograms. Default 3.
+    n_jobs : int, optional
+        Number of processes, each one handling whole shanks. If None, one per shank up to the number of CPUs.
+
+    Returns
+    -------
+    dict
+        Columns of the metrics table, one entry per cluster:
+        - 'cluster_id' : Kilosort cluster label.
+        - 'shank' : Shank (kcoords) of the channel closest to the cluster.
+        - 'x', 'y' : Mean position of the cluster spikes in microns.
+        - 'n_spikes' : Number of spikes.
+        - 'firing_rate' : Firing rate in Hz.
+        - 'isi_viol_count' : Number of ISIs shorter than the refractory period.
+        - 'isi_viol_rate' : ISI violation rate (Hill et al., 2011).
+        - 'amplitude_cutoff' : Estimated fraction of spikes missing below the detection threshold.
+    dict
+        Cross-correlograms of neighbouring clusters on the same shank:
+        - 'pairs' : (n_pairs, 2) cluster_id of each pair.
+        - 'ccgs' : (n_pairs, n_bins) spike counts, lag is second minus first cluster.
+        - 'bin_edges_ms' : Edges of the CCG bins in ms.
+
+    Notes
+    -----
+    - All metrics are computed from sorted arrays with np.bincount/np.searchsorted, without looping over clusters,
+      except the CCGs, which loop once per cluster over all its neighbours at once.
+    - Shanks are independent and are processed in parallel.
+    - If there are no spikes, empty tables are returned.
+    """
+    spike_times = np.asarray(spike_times)
+    if spike_times.ndim == 2:
+        spike_times = spike_times[:, 0]
+    spike_times = spike_times.astype(np.int64)
+    spike_clusters = np.asarray(spike_clusters).ravel()
+    amplitudes = np.asarray(amplitudes, dtype=float).ravel()
+    spike_positions = np.asarray(spike_positions, dtype=float)
+
+    bin_ms = max(int(round(ccg_bin_ms * fs / 1000)), 1) / fs * 1000
+    n_half = int(round(ccg_window_ms / ccg_bin_ms))
+    bin_edges_ms = np.arange(-n_half, n_half + 1) * bin_ms
+
+    # Nothing to compute if the sort found no spikes
+    if spike_times.size == 0:
+        print("No spikes found, cluster metrics are empty.")
+        metrics = {"cluster_id": np.zeros(0, dtype=np.int64),
+                   "shank": np.zeros(0, dtype=np.int64),
+                   "x": np.zeros(0),
+                   "y": np.zeros(0),
+                   "n_spikes": np.zeros(0, dtype=np.int64),
+                   "firing_rate": np.zeros(0),
+                   "isi_viol_count": np.zeros(0, dtype=np.int64),
+                   "isi_viol_rate": np.zeros(0),
+                   "amplitude_cutoff": np.zeros(0),
+                   }
+        ccgs = {"pairs": np.zeros((0, 2), dtype=np.int64),
+                "ccgs": np.zeros((0, 2 * n_half), dtype=np.int64),
+                "bin_edges_ms": bin_edges_ms,
+                }
+        return metrics, ccgs
+
+    if n_samples is None:
+        n_samples = spike_times.max() + 1
+    duration = n_samples / fs
+
+    options = {"refractory_ms": refractory_ms,
+               "ccg_window_ms": ccg_window_ms,
+               "ccg_bin_ms": ccg_bin_ms,
+               "neighbour_radius": neighbour_radius,
+               "amplitude_bins": amplitude_bins,
+               "amplitude_smoothing": amplitude_smoothing,
+               }
+
+    # Relabel clusters to 0..n_clusters - 1 and place them at the mean position of their spikes
+    cluster_ids, inverse = np.unique(spike_clusters, return_inverse=True)
+    inverse = inverse.ravel()
+    n_clusters = len(cluster_ids)
+    counts = np.bincount(inverse, minlength=n_clusters)
+    positions = np.column_stack([np.bincount(inverse, weights=spike_positions[:, i], minlength=n_clusters) / counts
+                                 for i in range(2)])
+
+    # Each cluster belongs to the shank of its closest channel
+    channels = np.column_stack([np.asarray(probe["xc"]), np.asarray(probe["yc"])])
+    closest = np.argmin(((positions[:, None, :] - channels[None, :, :]) ** 2).sum(axis=-1), axis=1)
+    cluster_shank = np.asarray(probe["kcoords"])[closest]
+
+    # Group spikes by shank in one pass
+    shanks = np.unique(cluster_shank)
+    spike_shank = cluster_shank[inverse]
+    order = np.argsort(spike_shank, kind='stable')
+    lo = np.searchsorted(spike_shank[order], shanks, side='left')
+    hi = np.searchsorted(spike_shank[order], shanks, side='right')
+
+    members = []
+    jobs = []
+    for shank, i, j in zip(shanks, lo, hi):
+        selection = order[i:j]
+        shank_clusters = np.flatnonzero(cluster_shank == shank)
+        members.append(shank_clusters)
+        jobs.append((spike_times[selection], np.searchsorted(shank_clusters, inverse[selection]),
+                     amplitudes[selection], positions[shank_clusters], fs, duration, options))
+
+    if n_jobs is None:
+        n_jobs = min(len(jobs), os.cpu_count() or 1)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_shank_metrics, *zip(*jobs)))
+    else:
+        results = [_shank_metrics(*job) for job in jobs]
+
+    metrics = {"cluster_id": cluster_ids,
+               "shank": cluster_shank,
+               "x": positions[:, 0],
+               "y": positions[:, 1],
+               }
+    for column in ["n_spikes", "firing_rate", "isi_viol_count", "isi_viol_rate", "amplitude_cutoff"]:
+        values = np.zeros(n_clusters, dtype=results[0][column].dtype)
+        for shank_clusters, result in zip(members, results):
+            values[shank_clusters] = result[column]
+        metrics[column] = values
+
+    ccgs = {"pairs": np.concatenate([cluster_ids[shank_clusters][result["pairs"]]
+                                     for shank_clusters, result in zip(members, results)]),
+            "ccgs": np.concatenate([result["ccgs"] for result in results]),
+            "bin_edges_ms": bin_edges_ms,
+            }
+    return metrics, ccgs
+
+
+def compute_cluster_metrics(results_dir, probe, fs, n_samples=None, output_dir=None, **kwargs):
+    """
+    Compute cluster metrics from a Kilosort results folder and save them in a subfolder of the results.
+
+    Parameters
+    ----------
+    results_dir : str
+        Kilosort results folder containing spike_times.npy, spike_clusters.npy,
+        amplitudes.npy and spike_positions.npy.
+    probe : dict
+        Probe dictionary with 'xc', 'yc' and 'kcoords', as returned by kilosort.io.load_probe.
+    fs : float
+        Sampling frequency in Hz.
+    n_samples : int, optional
+        Number of samples in the recording. If None, the last spike time is used.
+    output_dir : str, optional
+        Folder where the metrics are saved. If None, a 'metrics' folder inside results_dir is used.
+    **kwargs
+        Additional parameters passed to cluster_metrics.
+
+    Returns
+    -------
+    dict
+        Columns of the metrics table, see cluster_metrics.
+    dict
+        Cross-correlograms of neighbouring clusters, see cluster_metrics.
+
+    Notes
+    -----
+    - The metrics are saved as 'cluster_metrics.tsv', one column per metric.
+    - The CCGs are saved as 'cluster_ccgs.npz' with the arrays 'pairs', 'ccgs' and 'bin_edges_ms'.
+    - Both files go in a subfolder because Phy loads every .tsv of results_dir as cluster labels
+      and would write each metric back as its own cluster_<name>.tsv.
+
+    Raises
+    ------
+    FileNotFoundError
+        If any of the Kilosort results files is not found.
+    """
+    results_dir = Path(results_dir)
+    output_dir = results_dir / "metrics" if output_dir is None else Path(output_dir)
+    arrays = {}
+    for name in ["spike_times", "spike_clusters", "amplitudes", "spike_positions"]:
+        file_path = results_dir / f"{name}.npy"
+        if not file_path.exists():
+            raise FileNotFoundError(f"Kilosort results file not found: {file_path}")
+        arrays[name] = np.load(file_path)
+
+    metrics, ccgs = cluster_metrics(arrays["spike_times"], arrays["spike_clusters"], arrays["amplitudes"],
+                                    arrays["spike_positions"], probe, fs, n_samples=n_samples, **kwargs)
+
+    columns = list(metrics)
+    fmt = ["%d" if np.issubdtype(metrics[c].dtype, np.integer) else "%.6g" for c in columns]
+    output_dir.mkdir(parents=True, exist_ok=True)
+    np.savetxt(output_dir / "cluster_metrics.tsv", np.column_stack([metrics[c] for c in columns]),
+               fmt=fmt, delimiter="\t", header="\t".join(columns), comments="")
+    np.savez_compressed(output_dir / "cluster_ccgs.npz", **ccgs)
+
+    print(f"Cluster metrics saved to: {output_dir}")
+    return metrics, ccgs
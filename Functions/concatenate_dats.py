@@ -3,6 +3,7 @@ import glob
 import shutil
 import spikeinterface as si
 import spikeinterface.extractors as se
+from Functions.boundaries import get_boundaries, write_boundaries, load_boundaries
 
 def concatenate(path, xml_file_name):
     """
@@ -24,6 +25,13 @@ def concatenate(path, xml_file_name):
     str
         Name of the parent folder containing the .dat files.
 
+    Notes
+    -----
+    - When several .dat files are concatenated, the sample offset of each subsession is written
+      next to the concatenated recording as 'concatenated_recording_boundaries.csv'
+      (see Functions.boundaries). If an existing concatenated recording is reused, the boundaries are only
+      kept when they add up to its length.
+
     Raises
     ------
     FileNotFoundError
@@ -76,6 +84,10 @@ def concatenate(path, xml_file_name):
         recording.append(se.neuroscope.NeuroScopeRecordingExtractor(file_path=f, xml_file_path=xml_path))
     
     concatenated_recording = si.concatenate_recordings(recording)
+
+    # Record where each subsession starts so spikes can be mapped back without re-reading the files
+    boundaries = get_boundaries(dat_files, recording)
+    boundaries_path = os.path.join(basepath, 'concatenated_recording_boundaries.csv')
     
     # Define parent_folder for consistency across all code paths
     parent_folder = os.path.dirname(dat_files[0])  # Use parent folder of first .dat file
@@ -87,6 +99,21 @@ def concatenate(path, xml_file_name):
         user_input = input(f"The file '{output_path}' already exists. Do you want to overwrite it? (y/n): ").strip().lower()
         if user_input != 'y':
             print("Operation canceled. Existing concatenated recording will be used.")
+
+            # The existing file may come from other subsessions, only keep boundaries that match its length
+            bytes_per_sample = concatenated_recording.get_num_channels() * concatenated_recording.get_dtype().itemsize
+            file_samples = os.path.getsize(output_path) // bytes_per_sample
+            if os.path.exists(boundaries_path) and \
+                    sum(b["n_samples"] for b in load_boundaries(boundaries_path)) == file_samples:
+                print(f"Using the existing subsession boundaries: {boundaries_path}")
+            elif sum(b["n_samples"] for b in boundaries) == file_samples:
+                write_boundaries(boundaries_path, boundaries)
+            else:
+                print(f"Warning: '{output_path}' has {file_samples} samples but the .dat files add up to "
+                      f"{sum(b['n_samples'] for b in boundaries)}. Subsession boundaries can't be recovered, "
+                      "spikes will not be split into subsessions.")
+                if os.path.exists(boundaries_path):
+                    os.remove(boundaries_path)
             return True, grandparent_folder
     
     # Save the concatenated recording to disk using write_binary_recording
@@ -96,4 +123,5 @@ def concatenate(path, xml_file_name):
         progress_bar=True)  # Progress bars are cool
     
     print("Concatenated recording saved.")
+    write_boundaries(boundaries_path, boundaries)
     return True, grandparent_folder
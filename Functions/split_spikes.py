@@ -0,0 +1,103 @@
+import os
+import numpy as np
+from pathlib import Path
+from Functions.boundaries import load_boundaries
+
+
+def split_spikes(spike_times, spike_clusters, boundaries):
+    """
+    Partition spike times and cluster labels into per-subsession arrays.
+
+    Parameters
+    ----------
+    spike_times : numpy.ndarray
+        Spike times in samples of the concatenated recording. If 2D (as Kilosort's st),
+        the first column is used.
+    spike_clusters : numpy.ndarray
+        Cluster label of each spike.
+    boundaries : list of dict
+        Subsession boundaries, as returned by load_boundaries.
+
+    Returns
+    -------
+    list of dict
+        One entry per subsession with keys 'file', 'spike_times' (in samples, relative to the
+        start of the subsession) and 'spike_clusters'.
+
+    Notes
+    -----
+    - Spikes are sorted once if needed, and the subsession limits are then found with a single
+      np.searchsorted call, so the cost does not depend on the number of subsessions.
+    """
+    spike_times = np.asarray(spike_times)
+    if spike_times.ndim == 2:
+        spike_times = spike_times[:, 0]
+    spike_times = spike_times.astype(np.int64)
+    spike_clusters = np.asarray(spike_clusters)
+
+    # Kilosort output is sorted in time, only sort if it is not
+    if np.any(np.diff(spike_times) < 0):
+        order = np.argsort(spike_times, kind='stable')
+        spike_times = spike_times[order]
+        spike_clusters = spike_clusters[order]
+
+    starts = np.array([b["start_sample"] for b in boundaries], dtype=np.int64)
+    ends = starts + np.array([b["n_samples"] for b in boundaries], dtype=np.int64)
+    lo = np.searchsorted(spike_times, starts, side='left')
+    hi = np.searchsorted(spike_times, ends, side='left')
+
+    split = []
+    for b, start, i, j in zip(boundaries, starts, lo, hi):
+        split.append({
+            "file": b["file"],
+            "spike_times": spike_times[i:j] - start,
+            "spike_clusters": spike_clusters[i:j]
+        })
+    return split
+
+
+def save_split_spikes(results_dir, boundaries_path, output_dir=None):
+    """
+    Split Kilosort's spike_times.npy and spike_clusters.npy into one folder per subsession.
+
+    Parameters
+    ----------
+    results_dir : str
+        Kilosort results folder containing spike_times.npy and spike_clusters.npy.
+    boundaries_path : str
+        Path to the 'concatenated_recording_boundaries.csv' file.
+    output_dir : str, optional
+        Folder where the per-subsession folders are created.
+        If None, a 'subsessions' folder inside results_dir is used.
+
+    Returns
+    -------
+    list of Path
+        Folders written, one per subsession, named after the parent folder of each .dat file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the Kilosort results or the boundaries file are not found.
+    """
+    results_dir = Path(results_dir)
+    output_dir = results_dir / "subsessions" if output_dir is None else Path(output_dir)
+
+    times_path = results_dir / "spike_times.npy"
+    clusters_path = results_dir / "spike_clusters.npy"
+    if not times_path.exists() or not clusters_path.exists():
+        raise FileNotFoundError(f"Kilosort results not found in {results_dir}")
+
+    boundaries = load_boundaries(boundaries_path)
+    split = split_spikes(np.load(times_path), np.load(clusters_path), boundaries)
+
+    folders = []
+    for sub in split:
+        folder = output_dir / os.path.basename(os.path.dirname(sub["file"]))
+        folder.mkdir(parents=True, exist_ok=True)
+        np.save(folder / "spike_times.npy", sub["spike_times"])
+        np.save(folder / "spike_clusters.npy", sub["spike_clusters"])
+        folders.append(folder)
+
+    print(f"Spikes split into {len(folders)} subsessions in: {output_dir}")
+    return folders
@@ -1,11 +1,15 @@
 import sys
 import os
+import numpy as np
 from pathlib import Path
 from Functions.create_map import load_xml, create_channel_map_file
 from Functions.manage_xmls import find_xml_files, prompt_user_for_xml_file
 from Functions.concatenate_dats import concatenate
 from Functions.kilosort import kilosort_options
 from Functions.kilosort import kilosort_run
+from Functions.split_spikes import save_split_spikes
+from Functions.boundaries import load_boundaries
+from Functions.cluster_metrics import compute_cluster_metrics
 from Functions.find_and_load_session_mat import findAndLoadSessionMat, extractSessionData, validate_session_structure, extractSessionData
 from kilosort import io
 
@@ -77,6 +81,7 @@ def main():
             'n_chan': nChan
         }
         settings = {'n_chan_bin': probe['n_chan'], 'fs': sampleRate}
+        sampling_freq = sampleRate
         use = "session"
     else:
         print("Session is either not present or does not have the required fields. Trying to use .xml file")
@@ -104,6 +109,7 @@ def main():
         settings = kilosort_options(folder_path, info["sampling_freq"], info["n_chan"]+ len(exclude_channels), 
                                     info["n_groups"], info["hor_dist"], info["vert_dist"], 
                                     info["electrode_type"])
+        sampling_freq = info["sampling_freq"]
     
     for key, value in settings.items():
         print(f"{key}, {value}")
@@ -118,6 +124,27 @@ def main():
 
     kilosort_run(folder_path, settings, data_type, probe, filename=filename)
 
+    # Length of the recording that was sorted, needed for firing and violation rates
+    boundaries_path = os.path.join(folder_path, "concatenated_recording_boundaries.csv")
+    if concatenation_successful and os.path.exists(boundaries_path):
+        n_samples = sum(b["n_samples"] for b in load_boundaries(boundaries_path))
+    else:
+        n_samples = os.path.getsize(os.path.join(folder_path, filename)) // \
+            (settings["n_chan_bin"] * np.dtype(data_type).itemsize)
+
+    # Quality metrics and neighbour crosscorrelograms for every cluster
+    try:
+        compute_cluster_metrics(os.path.join(folder_path, "kilosort4"), probe, sampling_freq, n_samples=n_samples)
+    except FileNotFoundError as e:
+        print(f"Cluster metrics could not be computed: {e}")
+
+    # Split spikes back into the subsessions that were concatenated
+    if concatenation_successful:
+        try:
+            save_split_spikes(os.path.join(folder_path, "kilosort4"), boundaries_path)
+        except FileNotFoundError as e:
+            print(f"Spikes could not be split into subsessions: {e}")
+
 
 if __name__ == "__main__":
     main()